@@ -0,0 +1,178 @@
+"""Numba kernel for single-profile surface-based CAPE, CIN and LCL.
+
+Inputs are contiguous float64 arrays ordered from the surface upward:
+pressure in hPa, temperature and dewpoint in degC. Outputs match what
+get_sounding_indices reports: CAPE and CIN in J/kg (CIN <= 0) and the
+LCL pressure in hPa.
+
+The LCL uses Bolton (1980); the parcel follows a dry adiabat to the LCL and
+a pseudo-adiabat (RK4 in ln p) above it. Buoyancy uses virtual temperature,
+and CAPE/CIN are the same net areas metpy.calc.cape_cin reports: LFC to the
+topmost EL, and surface to the LFC clipped at zero.
+
+Every kernel declares its signature so Numba compiles (or loads the cached
+build) at import rather than on the first tool call.
+"""
+import math
+
+import numpy as np
+from numba import njit
+
+RD = 287.04749      # J/(kg K), dry air gas constant
+CP = 1004.6662      # J/(kg K), dry air specific heat at constant pressure
+LV = 2.50084e6      # J/kg, latent heat of vaporization
+EPS = 0.6219569     # Rd / Rv
+KAPPA = RD / CP
+ZERO_C = 273.15
+MAX_DLNP = 0.02     # largest RK4 step in ln(p)
+
+
+@njit('float64(float64, float64)', cache=True)
+def _sat_mixing_ratio(t_k, p):
+    # Bolton (1980) saturation vapor pressure, hPa
+    tc = t_k - ZERO_C
+    es = 6.112 * math.exp(17.67 * tc / (tc + 243.5))
+    return EPS * es / (p - es)
+
+
+@njit('float64(float64, float64)', cache=True)
+def _virtual_temp(t_k, w):
+    return t_k * (w + EPS) / (EPS * (1.0 + w))
+
+
+@njit('float64(float64, float64)', cache=True)
+def _moist_lapse(t_k, p):
+    # Pseudo-adiabatic dT/d(ln p)
+    rs = _sat_mixing_ratio(t_k, p)
+    return (RD * t_k + LV * rs) / (CP + LV * LV * rs * EPS / (RD * t_k * t_k))
+
+
+@njit('float64(float64, float64, float64)', cache=True)
+def _rk4_moist(t_k, p_from, p_to):
+    lnp = math.log(p_from)
+    span = math.log(p_to) - lnp
+    n = max(1, int(math.ceil(abs(span) / MAX_DLNP)))
+    h = span / n
+    for _ in range(n):
+        k1 = _moist_lapse(t_k, math.exp(lnp))
+        k2 = _moist_lapse(t_k + 0.5 * h * k1, math.exp(lnp + 0.5 * h))
+        k3 = _moist_lapse(t_k + 0.5 * h * k2, math.exp(lnp + 0.5 * h))
+        k4 = _moist_lapse(t_k + h * k3, math.exp(lnp + h))
+        t_k += h * (k1 + 2.0 * k2 + 2.0 * k3 + k4) / 6.0
+        lnp += h
+    return t_k
+
+
+@njit('float64(float64[::1], float64[::1], float64)', cache=True)
+def _interp(x, y, xq):
+    # Linear interpolation on increasing x, clamped at the ends
+    if xq <= x[0]:
+        return y[0]
+    for i in range(x.shape[0] - 1):
+        if xq <= x[i + 1]:
+            f = (xq - x[i]) / (x[i + 1] - x[i])
+            return y[i] + f * (y[i + 1] - y[i])
+    return y[x.shape[0] - 1]
+
+
+@njit('float64(float64[::1], float64[::1], float64, float64)', cache=True)
+def _integrate(x, b, xa, xb):
+    # Trapezoidal integral of piecewise-linear b over [xa, xb]
+    total = 0.0
+    for i in range(x.shape[0] - 1):
+        lo = max(x[i], xa)
+        hi = min(x[i + 1], xb)
+        if hi > lo:
+            total += 0.5 * (_interp(x, b, lo) + _interp(x, b, hi)) * (hi - lo)
+    return total
+
+
+@njit('UniTuple(float64, 3)(float64[::1], float64[::1], float64[::1])', cache=True)
+def sbcape_cin_lcl(p, t, td):
+    n = p.shape[0]
+    if n == 0:
+        return 0.0, 0.0, np.nan
+
+    t0 = t[0] + ZERO_C
+    td0 = td[0] + ZERO_C
+    p0 = p[0]
+
+    # Bolton (1980) eq. 15 for the LCL temperature, then Poisson for pressure
+    t_lcl = 1.0 / (1.0 / (td0 - 56.0) + math.log(t0 / td0) / 800.0) + 56.0
+    p_lcl = p0 * (t_lcl / t0) ** (1.0 / KAPPA)
+    if n < 2:
+        return 0.0, 0.0, p_lcl
+
+    # Work in x = ln(p0 / p), which increases upward. Like MetPy's
+    # parcel_profile_with_lcl, the LCL is inserted as an extra level with
+    # the environment interpolated in ln p.
+    x_lcl = math.log(p0 / p_lcl)
+    insert = p[n - 1] < p_lcl < p0
+    m = n + 1 if insert else n
+    x = np.empty(m)
+    pp = np.empty(m)
+    tv_env = np.empty(m)
+    j = 0
+    for i in range(n):
+        xi = math.log(p0 / p[i])
+        if insert and j == i and xi > x_lcl:
+            x[j] = x_lcl
+            pp[j] = p_lcl
+            tv_env[j] = np.nan
+            j += 1
+        x[j] = xi
+        pp[j] = p[i]
+        tv_env[j] = _virtual_temp(t[i] + ZERO_C, _sat_mixing_ratio(td[i] + ZERO_C, p[i]))
+        j += 1
+    for k in range(m):
+        if math.isnan(tv_env[k]):
+            f = (x[k] - x[k - 1]) / (x[k + 1] - x[k - 1])
+            tv_env[k] = tv_env[k - 1] + f * (tv_env[k + 1] - tv_env[k - 1])
+
+    # Parcel minus environment virtual temperature at every level. The
+    # parcel conserves its surface mixing ratio until it saturates at the LCL.
+    w0 = _sat_mixing_ratio(td0, p0)
+    buoy = np.empty(m)
+    t_moist = t_lcl
+    p_moist = p_lcl
+    for k in range(m):
+        if pp[k] >= p_lcl:
+            tp = t0 * (pp[k] / p0) ** KAPPA
+            w = w0
+        else:
+            t_moist = _rk4_moist(t_moist, p_moist, pp[k])
+            p_moist = pp[k]
+            tp = t_moist
+            w = _sat_mixing_ratio(t_moist, pp[k])
+        buoy[k] = _virtual_temp(tp, w) - tv_env[k]
+
+    # LFC: the LCL if the parcel is already buoyant there, otherwise the
+    # lowest crossing to positive buoyancy above it (MetPy's 'bottom' LFC)
+    x_lfc = np.nan
+    if _interp(x, buoy, x_lcl) > 0.0:
+        x_lfc = x_lcl
+    else:
+        for k in range(m - 1):
+            if x[k] >= x_lcl and buoy[k] <= 0.0 < buoy[k + 1]:
+                x_lfc = x[k] + (x[k + 1] - x[k]) * buoy[k] / (buoy[k] - buoy[k + 1])
+                break
+    if math.isnan(x_lfc):
+        return 0.0, 0.0, p_lcl
+
+    # EL: the highest crossing back to negative buoyancy above the LFC, or
+    # the top of the sounding if the parcel is still buoyant there
+    x_el = x[m - 1]
+    for k in range(m - 2, -1, -1):
+        if x[k + 1] <= x_lfc:
+            break
+        if buoy[k] > 0.0 >= buoy[k + 1]:
+            x_el = x[k] + (x[k + 1] - x[k]) * buoy[k] / (buoy[k] - buoy[k + 1])
+            break
+
+    # Net Rd * dTv * d(ln p): CAPE from the LFC to the EL, CIN from the
+    # surface to the LFC (clipped at zero), as metpy.calc.cape_cin does
+    cape = RD * _integrate(x, buoy, x_lfc, x_el)
+    cin = RD * _integrate(x, buoy, 0.0, x_lfc)
+    if cin >= 0.0:
+        cin = 0.0
+    return cape, cin, p_lcl
@@ -0,0 +1,19 @@
+"""Numba kernel for the nearest-station lookup in find_raob_station.
+
+The RAOB network is only ~100 sites, small enough that NumPy's per-call
+overhead rivals the distance math; a scalar compiled loop avoids it. The
+explicit signature compiles it eagerly at import.
+"""
+from numba import njit
+
+
+@njit('int64(float64[::1], float64[::1], float64, float64)', cache=True)
+def argmin_dist(lats, lons, lat0, lon0):
+    # Squared distance is enough to rank; the selects compile to branchless moves
+    best = 1e30
+    bi = -1
+    for i in range(lats.shape[0]):
+        d = (lats[i] - lat0) ** 2 + (lons[i] - lon0) ** 2
+        bi = i if d < best else bi
+        best = d if d < best else best
+    return bi
@@ -1,21 +1,70 @@
 import os
-import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
 import httpx
+import orjson
+import numpy as np
 import boto3
+from botocore.config import Config
+import matplotlib
+# Server-side rendering only: pin Agg and skip GUI/interactive machinery
+matplotlib.use('Agg')
+matplotlib.rcParams.update({
+    'toolbar': 'None',
+    'path.simplify_threshold': 1.0,
+    'agg.path.chunksize': 10000
+})
 import matplotlib.pyplot as plt
 import metpy.calc as mpcalc
-from metpy.plots import SkewT
+from metpy.plots import Hodograph, SkewT
 from metpy.units import units
 from fastmcp import FastMCP
 from io import BytesIO
+from PIL import Image
 
-mcp = FastMCP("RAOB-Severe-Weather-Suite")
+# Numba is optional; without it the indices fall back to MetPy and the
+# station search to a NumPy argmin
+try:
+    from _cape_kernel import sbcape_cin_lcl
+    from _station_kernel import argmin_dist
+except ImportError:
+    sbcape_cin_lcl = None
+    argmin_dist = None
+
+# --- Shared HTTP Client ---
+# All requests go to mesonet.agron.iastate.edu, so a single pooled client
+# keeps connections alive between tool calls instead of re-handshaking.
+_HTTP = httpx.AsyncClient(
+    timeout=30.0,
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=16, max_connections=32)
+)
+
+@asynccontextmanager
+async def _lifespan(server):
+    # Pooled connections belong to the server's event loop, so close them there.
+    # Stop the batch worker first so nothing is left waiting on a closed client.
+    try:
+        yield
+    finally:
+        worker = _FETCH_STATE["worker"]
+        if worker is not None and not worker.done():
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+        await _HTTP.aclose()
+
+mcp = FastMCP("RAOB-Severe-Weather-Suite", lifespan=_lifespan)
 
 # --- Optional S3 Configuration ---
 S3_BUCKET = os.getenv("S3_BUCKET_NAME")
 S3_ENDPOINT = os.getenv("S3_ENDPOINT_URL")
 AWS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET = os.getenv("AWS_SECRET_ACCESS_KEY")
+# Optional public/CDN base URL for uploaded plots; presigned URLs otherwise
+CDN_BASE_URL = os.getenv("CDN_BASE_URL")
+PRESIGNED_URL_TTL = 86400  # seconds
 
 # Only initialize S3 if all keys are present
 s3_enabled = all([S3_BUCKET, S3_ENDPOINT, AWS_KEY, AWS_SECRET])
@@ -27,55 +76,256 @@ if s3_enabled:
             's3',
             endpoint_url=S3_ENDPOINT,
             aws_access_key_id=AWS_KEY,
-            aws_secret_access_key=AWS_SECRET
+            aws_secret_access_key=AWS_SECRET,
+            # Pinned signing/addressing, a keepalive pool sized for concurrent
+            # uploads, and capped retries so a flaky PUT fails fast
+            config=Config(
+                signature_version='s3v4',
+                max_pool_connections=32,
+                retries={'max_attempts': 2, 'mode': 'standard'},
+                s3={'addressing_style': 'path'},
+                tcp_keepalive=True
+            )
         )
     except Exception as e:
         print(f"S3 Initialization failed: {e}")
         s3_enabled = False
 
+# --- RAOB Station Cache ---
+RAOB_STATIONS_URL = "https://mesonet.agron.iastate.edu/api/1/network/RAOB.json"
+STATIONS_TTL = 3600  # seconds; the RAOB network rarely changes
+
+# Station coordinates are kept as contiguous float64 arrays alongside the raw
+# records so nearest-station lookups are a single vectorized argmin.
+# Lowercased names and ids are precomputed the same way for text queries.
+_STATIONS_CACHE = {
+    "data": None, "lats": None, "lons": None,
+    "names_lc": None, "ids": None, "expires": 0.0
+}
+_STATIONS_LOCK = asyncio.Lock()
+
+# --- Batched Sounding Fetches ---
+# Requests are flushed every FETCH_BATCH_WINDOW seconds or as soon as
+# FETCH_BATCH_MAX are queued, which also caps concurrency against mesonet.
+FETCH_BATCH_WINDOW = 0.005
+FETCH_BATCH_MAX = 8
+
+_FETCH_QUEUE = deque()
+_FETCH_WAKE = asyncio.Event()
+_FETCH_STATE = {"worker": None}
+
+# --- Reusable Skew-T Figure ---
+# Built once at import; each call only swaps the data artists. Matplotlib is
+# not safe to share across concurrent renders, hence the lock.
+_SKEWT_FIG = plt.figure(figsize=(9, 9), layout='constrained')
+_SKEW = SkewT(_SKEWT_FIG, rotation=45)
+_SKEWT_LOCK = asyncio.Lock()
+
+# --- Profile Layout ---
+# Every mesonet level field we use, parsed once into one structured array
+PROFILE_FIELDS = ('pres', 'tmpc', 'dwpc', 'drct', 'sknt', 'hght')
+PROFILE_DTYPE = np.dtype([(f, 'f8') for f in PROFILE_FIELDS])
+THERMO_FIELDS = ('pres', 'tmpc', 'dwpc')
+WIND_FIELDS = ('pres', 'drct', 'sknt')
+
 # --- Helper Functions ---
 
+def _sounding_url(station, timestamp):
+    return f"https://mesonet.agron.iastate.edu/json/raob.py?station={station.upper()}&ts={timestamp}"
+
+def _profile_levels(res):
+    res.raise_for_status()
+    data = orjson.loads(res.content)
+    if not data.get("profiles"):
+        return None
+    return data["profiles"][0]["data"]
+
 async def fetch_sounding_data(station, timestamp):
-    url = f"https://mesonet.agron.iastate.edu/json/raob.py?station={station.upper()}&ts={timestamp}"
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        res = await client.get(url)
+    res = await _HTTP.get(_sounding_url(station, timestamp))
+    return _profile_levels(res)
+
+async def _fetch_worker():
+    while True:
+        await _FETCH_WAKE.wait()
+        # Give trailing requests a short window to join a partial batch
+        if len(_FETCH_QUEUE) < FETCH_BATCH_MAX:
+            await asyncio.sleep(FETCH_BATCH_WINDOW)
+        _FETCH_WAKE.clear()
+        while _FETCH_QUEUE:
+            batch = [_FETCH_QUEUE.popleft() for _ in range(min(FETCH_BATCH_MAX, len(_FETCH_QUEUE)))]
+            responses = await asyncio.gather(
+                *[_HTTP.get(url) for url, _ in batch], return_exceptions=True
+            )
+            for (_, fut), res in zip(batch, responses):
+                if fut.done():
+                    continue
+                if isinstance(res, Exception):
+                    fut.set_exception(res)
+                else:
+                    fut.set_result(res)
+
+async def fetch_many(pairs):
+    """Fetches several (station, timestamp) soundings through the shared batch queue.
+
+    Returns one entry per pair, in order: the profile levels, None when the
+    sounding is missing, or the exception raised for that fetch.
+    """
+    loop = asyncio.get_running_loop()
+    if _FETCH_STATE["worker"] is None or _FETCH_STATE["worker"].done():
+        _FETCH_STATE["worker"] = loop.create_task(_fetch_worker())
+
+    futures = []
+    for station, timestamp in pairs:
+        fut = loop.create_future()
+        _FETCH_QUEUE.append((_sounding_url(station, timestamp), fut))
+        futures.append(fut)
+    _FETCH_WAKE.set()
+
+    results = []
+    for res in await asyncio.gather(*futures, return_exceptions=True):
+        if isinstance(res, Exception):
+            results.append(res)
+            continue
+        try:
+            results.append(_profile_levels(res))
+        except Exception as e:
+            results.append(e)
+    return results
+
+async def _get_stations():
+    if _STATIONS_CACHE["data"] is not None and time.monotonic() < _STATIONS_CACHE["expires"]:
+        return _STATIONS_CACHE
+    async with _STATIONS_LOCK:
+        # Another caller may have refreshed the cache while we waited
+        if _STATIONS_CACHE["data"] is not None and time.monotonic() < _STATIONS_CACHE["expires"]:
+            return _STATIONS_CACHE
+        res = await _HTTP.get(RAOB_STATIONS_URL)
         res.raise_for_status()
-        data = res.json()
-        if not data.get("profiles"):
-            return None
-        return data["profiles"][0]["data"]
+        data = orjson.loads(res.content)["data"]
+        _STATIONS_CACHE["data"] = data
+        _STATIONS_CACHE["lats"] = np.array([s['lat'] for s in data], dtype=np.float64)
+        _STATIONS_CACHE["lons"] = np.array([s['lon'] for s in data], dtype=np.float64)
+        _STATIONS_CACHE["names_lc"] = np.array([s['name'].lower() for s in data], dtype=object)
+        _STATIONS_CACHE["ids"] = np.array([s['id'] for s in data], dtype=object)
+        _STATIONS_CACHE["expires"] = time.monotonic() + STATIONS_TTL
+        return _STATIONS_CACHE
 
-def upload_to_cloud(fig, file_prefix, station, timestamp):
-    if not s3_enabled:
-        return None
+def _profile_to_array(levels):
+    """Packs raw mesonet levels into a PROFILE_DTYPE array, with NaN for missing values."""
+    return np.fromiter(
+        (tuple(np.nan if l.get(k) is None else l[k] for k in PROFILE_FIELDS) for l in levels),
+        dtype=PROFILE_DTYPE, count=len(levels)
+    )
+
+def to_profile(levels, fields=THERMO_FIELDS):
+    """Parses levels and keeps only those where every one of ``fields`` is present."""
+    arr = _profile_to_array(levels)
+    mask = np.ones(arr.shape, dtype=bool)
+    for f in fields:
+        mask &= ~np.isnan(arr[f])
+    return arr[mask]
+
+def profile_quantities(arr):
+    """Attaches units to contiguous copies of the p/t/td columns for MetPy."""
+    p = np.ascontiguousarray(arr['pres']) * units.hPa
+    t = np.ascontiguousarray(arr['tmpc']) * units.degC
+    td = np.ascontiguousarray(arr['dwpc']) * units.degC
+    return p, t, td
+
+def wind_components(arr):
+    """u/v in knots from the drct/sknt columns, computed on bare ndarrays."""
+    drct_rad = np.deg2rad(arr['drct'])
+    u = -arr['sknt'] * np.sin(drct_rad)
+    v = -arr['sknt'] * np.cos(drct_rad)
+    return u, v
+
+def compute_indices(levels):
+    """Surface-based CAPE, CIN and LCL for one profile, or a message when it cannot be computed."""
+    if not levels: return "No data found."
+    
+    # Filter for valid data points
+    arr = to_profile(levels)
+    if not arr.size: return "Insufficient data for calculations."
+
+    if sbcape_cin_lcl is not None:
+        sbcape, sbcin, lcl_press = sbcape_cin_lcl(
+            np.ascontiguousarray(arr['pres']),
+            np.ascontiguousarray(arr['tmpc']),
+            np.ascontiguousarray(arr['dwpc'])
+        )
+    else:
+        p, t, td = profile_quantities(arr)
+        sbcape, sbcin = mpcalc.surface_based_cape_cin(p, t, td)
+        lcl_press, _ = mpcalc.lcl(p[0], t[0], td[0])
+        sbcape, sbcin, lcl_press = sbcape.magnitude, sbcin.magnitude, lcl_press.magnitude
     
+    return {
+        "sbcape_jkg": round(float(sbcape), 1),
+        # + 0.0 turns a rounded -0.0 into 0.0
+        "sbcin_jkg": round(float(sbcin), 1) + 0.0,
+        "lcl_hpa": round(float(lcl_press), 1)
+    }
+
+def render_png(fig):
+    # Render once with Agg and let Pillow encode; it is much quicker than
+    # Matplotlib's PNG writer. Figures are built with constrained layout,
+    # so there is no bbox_inches='tight' measuring pass either.
+    fig.canvas.draw()
+    buf = np.asarray(fig.canvas.buffer_rgba())
+
+    # The plots use only a handful of colors, so an 8-bit palette image
+    # feeds DEFLATE a quarter of the bytes of RGBA
+    img = Image.fromarray(buf).convert('P', palette=Image.Palette.ADAPTIVE, colors=64)
     img_buffer = BytesIO()
-    fig.savefig(img_buffer, format='png', bbox_inches='tight')
-    img_buffer.seek(0)
+    img.save(img_buffer, format='PNG', optimize=False, compress_level=1)
+    return img_buffer.getvalue()
+
+def upload_to_cloud(png, file_prefix, station, timestamp):
+    if not s3_enabled:
+        return None
     
+    # Plots are a few hundred KB, so a single PUT beats the managed
+    # multipart transfer that upload_fileobj sets up
     file_name = f"{file_prefix}_{station}_{timestamp}.png".replace(":", "")
-    s3_client.upload_fileobj(
-        img_buffer, S3_BUCKET, file_name,
-        ExtraArgs={'ContentType': 'image/png'}
+    s3_client.put_object(
+        Bucket=S3_BUCKET, Key=file_name,
+        Body=png, ContentType='image/png'
+    )
+    if CDN_BASE_URL:
+        return f"{CDN_BASE_URL.rstrip('/')}/{file_name}"
+    # Signed locally; no extra round trip to the S3 endpoint
+    return s3_client.generate_presigned_url(
+        'get_object', Params={'Bucket': S3_BUCKET, 'Key': file_name},
+        ExpiresIn=PRESIGNED_URL_TTL
     )
-    return f"{S3_ENDPOINT}/{S3_BUCKET}/{file_name}"
 
 # --- Tools (Always Work) ---
 
 @mcp.tool()
 async def find_raob_station(query: str = None, lat: float = None, lon: float = None):
     """Finds the nearest RAOB launch site."""
-    url = "https://mesonet.agron.iastate.edu/api/1/network/RAOB.json"
-    async with httpx.AsyncClient() as client:
-        res = await client.get(url)
-        stns_data = res.json()["data"]
+    stations = await _get_stations()
+    stns_data = stations["data"]
 
     if query:
-        matches = [s for s in stns_data if query.lower() in s['name'].lower() or query.upper() == s['id']]
-        return {"matches": matches[:5]}
+        q = query.lower()
+        names_lc = stations["names_lc"]
+        mask = np.fromiter((q in n for n in names_lc), dtype=bool, count=len(names_lc))
+        mask |= stations["ids"] == query.upper()
+        matches = [stns_data[i] for i in np.nonzero(mask)[0][:5]]
+        return {"matches": matches}
 
     if lat is not None and lon is not None:
-        closest = min(stns_data, key=lambda s: math.sqrt((lat - s['lat'])**2 + (lon - s['lon'])**2))
+        if not stns_data:
+            return "No RAOB stations available."
+        if not (np.isfinite(lat) and np.isfinite(lon)):
+            return "Coordinates must be finite numbers."
+        if argmin_dist is not None:
+            idx = int(argmin_dist(stations["lats"], stations["lons"], float(lat), float(lon)))
+        else:
+            # Squared distance is enough to rank; sqrt is monotonic
+            idx = int(np.argmin((stations["lats"] - lat)**2 + (stations["lons"] - lon)**2))
+        closest = stns_data[idx]
         return {"closest_station": closest}
     return "Provide a query or coordinates."
 
@@ -83,24 +333,41 @@ async def find_raob_station(query: str = None, lat: float = None, lon: float = N
 async def get_sounding_indices(station: str, timestamp: str):
     """Calculates thermodynamic indices (CAPE, CIN, LCL)."""
     levels = await fetch_sounding_data(station, timestamp)
-    if not levels: return "No data found."
-    
-    # Filter for valid data points
-    clean = [l for l in levels if all(l.get(k) is not None for k in ['pres', 'tmpc', 'dwpc'])]
-    if not clean: return "Insufficient data for calculations."
+    return compute_indices(levels)
 
-    p = [l['pres'] for l in clean] * units.hPa
-    t = [l['tmpc'] for l in clean] * units.degC
-    td = [l['dwpc'] for l in clean] * units.degC
-    
-    sbcape, sbcin = mpcalc.surface_based_cape_cin(p, t, td)
-    lcl_press, _ = mpcalc.lcl(p[0], t[0], td[0])
-    
-    return {
-        "sbcape_jkg": round(float(sbcape.magnitude), 1),
-        "sbcin_jkg": round(float(sbcin.magnitude), 1),
-        "lcl_hpa": round(float(lcl_press.magnitude), 1)
-    }
+@mcp.tool()
+async def get_sounding_indices_batch(entries: list[dict]):
+    """Calculates CAPE, CIN and LCL for several soundings at once.
+
+    Each entry is {"station": ..., "timestamp": ...}.
+    """
+    results = []
+    pairs = []
+    for e in entries:
+        station = e.get("station") if isinstance(e, dict) else None
+        timestamp = e.get("timestamp") if isinstance(e, dict) else None
+        # Numeric WMO ids are common; accept them as strings
+        if isinstance(station, int) and not isinstance(station, bool):
+            station = str(station)
+        result = {"station": station, "timestamp": timestamp}
+        if not isinstance(station, str) or not isinstance(timestamp, str):
+            result["indices"] = "Invalid entry: expected {\"station\": <id>, \"timestamp\": <ISO string>}."
+        else:
+            pairs.append((station, timestamp, result))
+        results.append(result)
+
+    fetched = await fetch_many([(station, timestamp) for station, timestamp, _ in pairs])
+
+    async def _indices(levels):
+        if isinstance(levels, Exception):
+            return f"Fetch failed: {levels}"
+        # The MetPy fallback can take long enough to stall other tool calls
+        return await asyncio.to_thread(compute_indices, levels)
+
+    computed = await asyncio.gather(*[_indices(levels) for levels in fetched])
+    for (_, _, result), indices in zip(pairs, computed):
+        result["indices"] = indices
+    return {"results": results}
 
 # --- Tools (Require S3) ---
 
@@ -113,19 +380,53 @@ async def generate_skewt(station: str, timestamp: str):
     levels = await fetch_sounding_data(station, timestamp)
     if not levels: return "No data found."
 
-    clean = [l for l in levels if all(l.get(k) is not None for k in ['pres', 'tmpc', 'dwpc'])]
+    arr = to_profile(levels)
     
-    p = [l['pres'] for l in clean] * units.hPa
-    t = [l['tmpc'] for l in clean] * units.degC
-    td = [l['dwpc'] for l in clean] * units.degC
+    p, t, td = profile_quantities(arr)
     
-    fig = plt.figure(figsize=(9, 9))
-    skew = SkewT(fig, rotation=45)
-    skew.plot(p, t, 'r', linewidth=2)
-    skew.plot(p, td, 'g', linewidth=2)
-    
-    url = upload_to_cloud(fig, "skewt", station, timestamp)
+    async with _SKEWT_LOCK:
+        for artist in (*_SKEW.ax.lines, *_SKEW.ax.collections):
+            artist.remove()
+        _SKEW.plot(p, t, 'r', linewidth=2)
+        _SKEW.plot(p, td, 'g', linewidth=2)
+
+        # Rendering and encoding block; keep them off the event loop
+        png = await asyncio.to_thread(render_png, _SKEWT_FIG)
+
+    # The figure is free again once encoded, so the PUT runs outside the lock
+    url = await asyncio.to_thread(upload_to_cloud, png, "skewt", station, timestamp)
+    return {"url": url}
+
+@mcp.tool()
+async def generate_hodograph(station: str, timestamp: str):
+    """Generates a Hodograph (Requires S3 configuration)."""
+    if not s3_enabled:
+        return "Plotting is disabled. Please configure S3 environment variables on Railway."
+
+    levels = await fetch_sounding_data(station, timestamp)
+    if not levels: return "No data found."
+
+    arr = to_profile(levels, WIND_FIELDS)
+    if not arr.size: return "No wind data found."
+
+    u, v = wind_components(arr)
+
+    fig = plt.figure(figsize=(6, 6), layout='constrained')
+    ax = fig.add_subplot(1, 1, 1)
+    hodo = Hodograph(ax, component_range=80)
+    hodo.add_grid(increment=20)
+    hodo.plot(u * units.knots, v * units.knots, color='r', linewidth=2)
+
+    png = await asyncio.to_thread(render_png, fig)
+
+    # Tear the figure down while the PUT is in flight. run_in_executor
+    # submits the job immediately (a to_thread task would not start until
+    # the loop next yields); pyplot's figure registry is not thread-safe,
+    # so the close stays on the loop thread.
+    loop = asyncio.get_running_loop()
+    upload = loop.run_in_executor(None, upload_to_cloud, png, "hodograph", station, timestamp)
     plt.close(fig)
+    url = await upload
     return {"url": url}
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+mpcalc = pytest.importorskip("metpy.calc")
+from metpy.units import units
+
+from _cape_kernel import sbcape_cin_lcl
+
+
+def _profile(t_sfc, td_sfc=22.0, lapse=7.2, cap=0.0, warm=0.0, noise=0.0):
+    # 46 levels, 1000-100 hPa: constant lapse rate to an 11 km tropopause,
+    # a moist surface layer, an optional capping inversion near 1.5 km, an
+    # optional stable warm layer near 5 km and optional seeded noise
+    p = np.linspace(1000.0, 100.0, 46)
+    z = 7.0 * np.log(1000.0 / p)
+    t = np.where(z < 11, t_sfc - lapse * z, t_sfc - lapse * 11)
+    t = t + cap * np.exp(-((z - 1.5) / 0.4) ** 2)
+    t = t + warm * np.exp(-((z - 5.0) / 0.5) ** 2)
+    t = t + noise * np.random.default_rng(0).standard_normal(p.shape)
+    td = np.minimum(t - 0.5, td_sfc - 5.0 * z)
+    return p, t, td
+
+
+PROFILES = [
+    dict(t_sfc=27.0), dict(t_sfc=31.0), dict(t_sfc=32.0, cap=2.0),
+    dict(t_sfc=36.0, cap=2.0), dict(t_sfc=20.0, td_sfc=13.0, lapse=8.0),
+    dict(t_sfc=22.0, td_sfc=17.0, lapse=7.0), dict(t_sfc=21.0, td_sfc=13.0, lapse=8.0),
+    # Buoyancy that goes negative and positive again above the LFC
+    dict(t_sfc=30.0, warm=3.0), dict(t_sfc=30.0, warm=6.0), dict(t_sfc=30.0, warm=10.0),
+    dict(t_sfc=30.0, warm=4.0, cap=1.0),
+    dict(t_sfc=30.0, noise=0.8), dict(t_sfc=28.0, cap=1.5, noise=1.2), dict(t_sfc=26.0, noise=2.0),
+    dict(t_sfc=30.0, noise=2.0), dict(t_sfc=32.0, noise=1.5, warm=3.0)
+]
+
+
+@pytest.mark.parametrize("kwargs", PROFILES)
+def test_matches_metpy(kwargs):
+    p, t, td = _profile(**kwargs)
+    cape, cin, lcl_p = sbcape_cin_lcl(p, t, td)
+
+    ref_cape, ref_cin = mpcalc.surface_based_cape_cin(p * units.hPa, t * units.degC, td * units.degC)
+    ref_lcl, _ = mpcalc.lcl(p[0] * units.hPa, t[0] * units.degC, td[0] * units.degC)
+
+    assert cape == pytest.approx(ref_cape.m, rel=0.05, abs=30.0)
+    assert cin == pytest.approx(ref_cin.m, rel=0.05, abs=10.0)
+    assert lcl_p == pytest.approx(ref_lcl.m, abs=1.0)
+
+
+@pytest.mark.parametrize("kwargs", PROFILES)
+def test_compiled_matches_python(kwargs):
+    # Guards against compiler flags (e.g. fastmath) changing the LFC/CIN bookkeeping
+    p, t, td = _profile(**kwargs)
+    assert sbcape_cin_lcl(p, t, td) == pytest.approx(sbcape_cin_lcl.py_func(p, t, td))
+
+
+def test_stable_profile_has_no_cin():
+    p = np.linspace(1000.0, 100.0, 46)
+    t = np.full_like(p, 20.0)
+    td = t - 20.0
+    cape, cin, _ = sbcape_cin_lcl(p, t, td)
+    assert cape == 0.0
+    assert cin == 0.0
+
+
+def test_cin_is_never_negative_zero():
+    # Near-saturated, superadiabatic surface layer: the parcel is buoyant
+    # straight away, so the net area below the LFC is clipped to zero
+    p, t, td = _profile(24.0, td_sfc=23.9, lapse=7.5)
+    t[1:] -= 2.0
+    td[0] = t[0] - 0.05
+    _, cin, _ = sbcape_cin_lcl(p, t, td)
+    assert cin == 0.0
+    assert math.copysign(1.0, cin) == 1.0